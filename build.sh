@@ -10,3 +10,5 @@ python manage.py collectstatic --no-input
 
 
 python manage.py migrate
+python manage.py createcachetable
+python manage.py sweep_unverified
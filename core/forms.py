@@ -1,9 +1,27 @@
+import re
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 from .models import Note, Profile, Comment
 
+MAX_NOTE_FILE_SIZE = 35 * 1024 * 1024
+
+_USERNAME_RE = re.compile(r'\A[A-Za-z0-9_]{1,15}\Z')
+
+_IMAGE_MAGICS = (
+    b'\xff\xd8\xff',         # JPEG
+    b'\x89PNG\r\n\x1a\n',    # PNG
+    b'GIF87a', b'GIF89a',
+    b'BM',                   # BMP
+)
+
+
+def _is_image_header(head):
+    if head.startswith(_IMAGE_MAGICS):
+        return True
+    return head[:4] == b'RIFF' and head[8:12] == b'WEBP'
+
 
 class UserRegisterForm(UserCreationForm):
     first_name = forms.CharField(
@@ -28,10 +46,8 @@ class UserRegisterForm(UserCreationForm):
 
     def clean_username(self):
         username = self.cleaned_data.get('username')
-        if len(username) > 15:
-            raise ValidationError("Username must be 15 characters or fewer.")
-        if not username.isalnum() and "_" not in username:
-            raise ValidationError("Username can only contain letters, numbers, and underscores.")
+        if not _USERNAME_RE.match(username):
+            raise ValidationError("Username must be 1-15 chars, letters/digits/underscore only.")
         return username
 
 
@@ -59,7 +75,9 @@ class ProfileForm(forms.ModelForm):
         if pic:
             if pic.size > 5 * 1024 * 1024:
                 raise ValidationError("Image too large. Max size is 5MB.")
-            if not pic.content_type.startswith('image/'):
+            head = pic.read(12)
+            pic.seek(0)
+            if not _is_image_header(head):
                 raise ValidationError("Invalid file. Please upload an image.")
         return pic
 
@@ -95,7 +113,7 @@ class NoteForm(forms.ModelForm):
     def clean_file(self):
         file = self.cleaned_data.get('file')
         if file:
-            if file.size > 35 * 1024 * 1024:
+            if file.size > MAX_NOTE_FILE_SIZE:
                 raise ValidationError("File too large. Max size is 35MB.")
         return file
 
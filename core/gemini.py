@@ -1,50 +1,156 @@
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from django.conf import settings
+from django.core.cache import cache
+import functools
+import hashlib
 import logging
+import mmap
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = 'gemini-2.5-flash'
+PROCESSING_TIMEOUT = 30
+UPLOAD_CACHE_TIMEOUT = 40 * 60 * 60
+MMAP_HASH_THRESHOLD = 64 * 1024
+BUFFERED_UPLOAD_THRESHOLD = 10 * 1024 * 1024
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+
+BASE_INSTRUCTION = (
+    "You are a helpful student assistant. "
+    "Use Markdown for text formatting. "
+    "For Math, use LaTeX wrapped in $ or $$. "
+    "CRITICAL: Wrap commands like \\left in backticks if explaining them. "
+)
+
+CONTEXT_HEADER = "\n\n=== METADATA & COMMENTS ===\n"
+QUESTION_HEADER = "\n\n=== USER QUESTION ===\n"
+
+_CLEANUP_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='gemini-cleanup')
+
+_configure_lock = threading.Lock()
+_configured_key = None
+
+
+def _ensure_configured(api_key):
+    global _configured_key
+    if _configured_key == api_key:
+        return
+    with _configure_lock:
+        if _configured_key != api_key:
+            genai.configure(api_key=api_key)
+            _configured_key = api_key
+
+
+@functools.lru_cache(maxsize=256)
+def _get_model(user_instructions=None):
+    system_instruction = BASE_INSTRUCTION
+    if user_instructions:
+        system_instruction += f"\n\nUSER PREFERENCES:\n{user_instructions}\n"
+    return genai.GenerativeModel(MODEL_NAME, system_instruction=system_instruction)
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < MMAP_HASH_THRESHOLD:
+            h.update(f.read())
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(memoryview(mm))
+    return h.hexdigest()
+
+
+def _upload_and_wait(file_path, mime_type):
+    if os.path.getsize(file_path) > BUFFERED_UPLOAD_THRESHOLD:
+        # Given a path, the SDK opens the file itself and leaves it open until garbage collection.
+        with open(file_path, 'rb', buffering=UPLOAD_BUFFER_SIZE) as f:
+            uploaded_file = genai.upload_file(f, mime_type=mime_type, display_name=os.path.basename(file_path))
+    else:
+        uploaded_file = genai.upload_file(file_path, mime_type=mime_type)
+
+    deadline = time.monotonic() + PROCESSING_TIMEOUT
+    delay = 0.1
+
+    while uploaded_file.state.name == "PROCESSING":
+        if time.monotonic() > deadline:
+            _CLEANUP_POOL.submit(_safe_delete, uploaded_file.name)
+            raise TimeoutError("File processing timed out.")
+        time.sleep(delay)
+        delay = min(delay * 2, 2.0)
+        uploaded_file = genai.get_file(uploaded_file.name)
+
+    if uploaded_file.state.name == "FAILED":
+        _CLEANUP_POOL.submit(_safe_delete, uploaded_file.name)
+        raise ValueError("Google AI failed to process this file.")
+    return uploaded_file
+
+
+def _safe_delete(name):
+    # Runs on _CLEANUP_POOL, whose futures nobody reads: anything not logged here is lost.
+    try:
+        genai.delete_file(name)
+    except google_exceptions.GoogleAPIError as e:
+        logger.warning(f"Could not delete uploaded file {name}: {e}")
+    except Exception:
+        logger.exception(f"Could not delete uploaded file {name}")
+
+
+def _upload_unusable(error, name):
+    # Quota and availability errors say nothing about the upload, which stays valid for reuse.
+    if isinstance(error, (google_exceptions.NotFound, google_exceptions.PermissionDenied)):
+        return True
+    if isinstance(error, (google_exceptions.FailedPrecondition, google_exceptions.InvalidArgument)):
+        return name.rsplit('/', 1)[-1] in str(error)
+    return False
+
+
+def _discard_upload(key, name):
+    cache.delete(key)
+    _CLEANUP_POOL.submit(_safe_delete, name)
+
+
+def _cached_upload(file_path, mime_type):
+    # Gemini keeps uploads for ~48h, so identical files are uploaded once and reused.
+    key = f"gemini_upload:{mime_type}:{_file_sha256(file_path)}"
+    name = cache.get(key)
+    if name:
+        try:
+            uploaded_file = genai.get_file(name)
+            if uploaded_file.state.name == "ACTIVE":
+                return uploaded_file, key
+            _discard_upload(key, name)
+        except google_exceptions.NotFound:
+            cache.delete(key)
+        except google_exceptions.GoogleAPIError as e:
+            logger.warning(f"Cached upload {name} unavailable: {e}")
+            _discard_upload(key, name)
+
+    uploaded_file = _upload_and_wait(file_path, mime_type)
+    cache.set(key, uploaded_file.name, timeout=UPLOAD_CACHE_TIMEOUT)
+    return uploaded_file, key
+
+
 def generate_study_help(user_prompt: str, context: str = "", user_instructions: str = None, file_path: str = None, mime_type: str = None) -> str:
     api_key = getattr(settings, 'GOOGLE_API_KEY', None)
     if not api_key:
         return "Configuration Error: Google API Key not found."
 
-    genai.configure(api_key=api_key)
+    _ensure_configured(api_key)
 
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash') 
-        
-        base_instruction = (
-            "You are a helpful student assistant. "
-            "Use Markdown for text formatting. "
-            "For Math, use LaTeX wrapped in $ or $$. "
-            "CRITICAL: Wrap commands like \\left in backticks if explaining them. "
-        )
-
-        if user_instructions and user_instructions.strip():
-            base_instruction += f"\n\nUSER PREFERENCES:\n{user_instructions}\n"
+        model = _get_model((user_instructions or "").strip() or None)
 
-        uploaded_file = None
-        content_parts = [base_instruction]
+        upload_key = None
+        content_parts = []
 
         if file_path and mime_type:
             try:
-                uploaded_file = genai.upload_file(file_path, mime_type=mime_type)
-                
-                max_retries = 30
-                retry_count = 0
-                
-                while uploaded_file.state.name == "PROCESSING":
-                    if retry_count > max_retries:
-                        raise TimeoutError("File processing timed out.")
-                    time.sleep(1)
-                    uploaded_file = genai.get_file(uploaded_file.name)
-                    retry_count += 1
-
-                if uploaded_file.state.name == "FAILED":
-                    raise ValueError("Google AI failed to process this file.")
-                
+                uploaded_file, upload_key = _cached_upload(file_path, mime_type)
                 content_parts.append(uploaded_file)
                 content_parts.append("(File content is attached above)")
                 
@@ -53,17 +159,16 @@ def generate_study_help(user_prompt: str, context: str = "", user_instructions:
                 content_parts.append(f"\n[System Warning: Could not analyze the file directly ({str(e)}). Using metadata only.]")
 
         if context:
-            content_parts.append(f"\n\n=== METADATA & COMMENTS ===\n{context}")
-        
-        content_parts.append(f"\n\n=== USER QUESTION ===\n{user_prompt}")
+            content_parts.append(CONTEXT_HEADER + context)
+        content_parts.append(QUESTION_HEADER + user_prompt)
 
-        response = model.generate_content(content_parts)
-        
-        if uploaded_file:
-            try:
-                uploaded_file.delete()
-            except:
-                pass 
+        try:
+            response = model.generate_content(content_parts)
+        except google_exceptions.GoogleAPIError as e:
+            # The cached upload may have expired on Google's side; re-upload next time.
+            if upload_key and _upload_unusable(e, uploaded_file.name):
+                _discard_upload(upload_key, uploaded_file.name)
+            raise
 
         return response.text
 
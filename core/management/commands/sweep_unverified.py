@@ -0,0 +1,17 @@
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Delete sign-ups that never verified their email."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help="Age after which an unverified account is removed.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        # Accounts that have logged in before were deactivated on purpose, not abandoned.
+        _, deleted = User.objects.filter(is_active=False, last_login__isnull=True, date_joined__lt=cutoff).delete()
+        self.stdout.write(f"Removed {deleted.get('auth.User', 0)} unverified account(s).")
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-15 06:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_profile_ai_instructions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_at'], name='core_commen_post_id_0d7c44_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['-created_at'], name='core_note_created_5eb837_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['-view_count'], name='core_note_view_co_49f1e7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['user', '-created_at'], name='core_note_user_id_19c1fc_idx'),
+        ),
+    ]
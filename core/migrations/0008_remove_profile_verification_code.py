@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-15 06:09
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_note_list_and_comment_thread_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='profile',
+            name='verification_code',
+        ),
+    ]
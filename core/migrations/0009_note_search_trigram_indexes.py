@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Django compiles `field__icontains` on PostgreSQL to `UPPER("field"::text) LIKE UPPER(%s)`,
+# so the trigram indexes are built on that exact expression for the planner to use them.
+# Other backends (SQLite locally), or servers without pg_trgm, are left untouched.
+SEARCH_FIELDS = ['title', 'tags', 'course', 'description']
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS core_note_{field}_trgm_idx '
+            f'ON core_note USING gin (UPPER("{field}"::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS core_note_{field}_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_remove_profile_verification_code'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-15 06:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_note_counters(apps, schema_editor):
+    Note = apps.get_model('core', 'Note')
+    Comment = apps.get_model('core', 'Comment')
+    Rating = apps.get_model('core', 'Rating')
+    avg = Rating.objects.filter(note=OuterRef('pk')).values('note').annotate(avg=Avg('score')).values('avg')
+    count = Comment.objects.filter(post=OuterRef('pk')).values('post').annotate(cnt=Count('id')).values('cnt')
+    Note.objects.update(
+        avg_rating=Coalesce(Subquery(avg, output_field=FloatField()), Value(0.0)),
+        comment_count=Coalesce(Subquery(count, output_field=IntegerField()), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_note_search_trigram_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='avg_rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_note_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['-avg_rating'], name='core_note_avg_rat_e0ad40_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-15 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_note_rating_and_comment_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='ai_file_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='ai_status',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='ai_status_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='ai_status_msg',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-15 06:45
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Note = apps.get_model('core', 'Note')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    username = Subquery(User.objects.filter(pk=OuterRef('user_id')).values('username')[:1])
+    Note.objects.update(search_vector=(
+        SearchVector('title', weight='A', config='english') +
+        SearchVector('tags', weight='B', config='english') +
+        SearchVector('course', weight='C', config='english') +
+        SearchVector(username, weight='D', config='english') +
+        SearchVector('description', weight='D', config='english')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_note_ai_status_cache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,56 @@
+import logging
 import os
-from django.db import models
+import threading
+from functools import partial
+from django.db import connections, models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_delete, pre_save
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models import Avg, F, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from PIL import Image
-from .utils import delete_file_if_exists
+from .utils import delete_file_if_exists, delete_file_if_exists_by_path, invalidate_home_cache, invalidate_rating_cache, invalidate_note_cache
+
+logger = logging.getLogger(__name__)
+
+_FILE_TYPE_EXTS = {
+    'image': ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.bmp'],
+    'video': ['.mp4', '.webm', '.ogg', '.mov'],
+    'audio': ['.mp3', '.wav'],
+    'pdf': ['.pdf'],
+    'office': ['.docx', '.doc', '.xlsx', '.xls', '.pptx', '.ppt'],
+    'code': [
+        '.txt', '.md', '.csv', '.json', '.xml', '.log',
+        '.py', '.js', '.html', '.css', '.java', '.cpp', '.c', '.h',
+        '.sql', '.sh', '.bat', '.php', '.rb', '.go', '.rs', '.ts',
+        '.yaml', '.yml', '.ini', '.conf', '.env'
+    ],
+}
+_EXT_TYPE = {ext: ftype for ftype, exts in _FILE_TYPE_EXTS.items() for ext in exts}
+
+PROFILE_PIC_SIZE = (300, 300)
+PROFILE_PIC_MIN_BYTES = 50 * 1024
+
+
+def _compress_profile_pic(path):
+    try:
+        if os.path.getsize(path) < PROFILE_PIC_MIN_BYTES:
+            return
+        with Image.open(path) as img:
+            if img.height <= PROFILE_PIC_SIZE[1] and img.width <= PROFILE_PIC_SIZE[0]:
+                return
+            # Lets libjpeg downscale during decode; a no-op for other formats.
+            img.draft('RGB', PROFILE_PIC_SIZE)
+            img.thumbnail(PROFILE_PIC_SIZE, Image.Resampling.LANCZOS)
+            img.save(path, optimize=True, quality=85, progressive=True)
+    except (OSError, Image.UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning(f"Error compressing image {path}: {e}")
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(blank=True)
     profile_pic = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
-    verification_code = models.CharField(max_length=6, blank=True, null=True)
     ai_instructions = models.TextField(blank=True, null=True)
 
     def __str__(self):
@@ -18,15 +58,12 @@ class Profile(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        if self.profile_pic:
-            try:
-                img = Image.open(self.profile_pic.path)
-                if img.height > 300 or img.width > 300:
-                    output_size = (300, 300)
-                    img.thumbnail(output_size)
-                    img.save(self.profile_pic.path)
-            except Exception as e:
-                print(f"Error compressing image: {e}")
+        if self.profile_pic and getattr(self, '_pic_changed', False):
+            threading.Thread(
+                target=_compress_profile_pic,
+                args=(self.profile_pic.path,),
+                daemon=True
+            ).start()
 
 class Note(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -37,12 +74,23 @@ class Note(models.Model):
     file = models.FileField(upload_to='notes/')
     created_at = models.DateTimeField(auto_now_add=True)
     view_count = models.PositiveIntegerField(default=0)
+    avg_rating = models.FloatField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    ai_status = models.CharField(max_length=20, blank=True)
+    ai_status_msg = models.CharField(max_length=200, blank=True)
+    ai_file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    ai_status_checked_at = models.DateTimeField(null=True, blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         indexes = [
             models.Index(fields=['title']),
             models.Index(fields=['course']),
             models.Index(fields=['tags']),
+            models.Index(fields=['-created_at']),
+            models.Index(fields=['-view_count']),
+            models.Index(fields=['-avg_rating']),
+            models.Index(fields=['user', '-created_at']),
         ]
 
     def __str__(self):
@@ -52,28 +100,8 @@ class Note(models.Model):
         if not self.file:
             return 'none'
         
-        _, ext = os.path.splitext(self.file.name)
-        ext = ext.lower()
-
-        if ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.bmp']:
-            return 'image'
-        elif ext in ['.mp4', '.webm', '.ogg', '.mov']:
-            return 'video'
-        elif ext in ['.mp3', '.wav']:
-            return 'audio'
-        elif ext == '.pdf':
-            return 'pdf'
-        elif ext in ['.docx', '.doc', '.xlsx', '.xls', '.pptx', '.ppt']:
-            return 'office'
-        elif ext in [
-            '.txt', '.md', '.csv', '.json', '.xml', '.log', 
-            '.py', '.js', '.html', '.css', '.java', '.cpp', '.c', '.h', 
-            '.sql', '.sh', '.bat', '.php', '.rb', '.go', '.rs', '.ts',
-            '.yaml', '.yml', '.ini', '.conf', '.env'
-        ]:
-            return 'code'
-        else:
-            return 'other'
+        ext = os.path.splitext(self.file.name)[1].lower()
+        return _EXT_TYPE.get(ext, 'other')
     
 class Comment(models.Model):
     post = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='comments')
@@ -81,6 +109,11 @@ class Comment(models.Model):
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created_at']),
+        ]
+
 class Rating(models.Model):
     note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='ratings')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -89,6 +122,28 @@ class Rating(models.Model):
     class Meta:
         unique_together = ('note', 'user')
 
+def note_avg_rating_subquery():
+    avg = Rating.objects.filter(note=OuterRef('pk')).values('note').annotate(avg=Avg('score')).values('avg')
+    return Coalesce(Subquery(avg, output_field=FloatField()), Value(0.0))
+
+NOTE_SEARCH_FIELDS = {'title', 'tags', 'course', 'description', 'user'}
+
+def note_search_vector():
+    # Updates can't reference joined columns, so the author's name comes in through a subquery.
+    username = Subquery(User.objects.filter(pk=OuterRef('user_id')).values('username')[:1])
+    return (
+        SearchVector('title', weight='A', config='english') +
+        SearchVector('tags', weight='B', config='english') +
+        SearchVector('course', weight='C', config='english') +
+        SearchVector(username, weight='D', config='english') +
+        SearchVector('description', weight='D', config='english')
+    )
+
+def refresh_note_search_vectors(using, **filters):
+    # The stored vector only ranks search results on PostgreSQL; other backends rank with CASE.
+    if connections[using].vendor == 'postgresql':
+        Note.objects.using(using).filter(**filters).update(search_vector=note_search_vector())
+
 @receiver(post_delete, sender=Note)
 def auto_delete_note_file(sender, instance, **kwargs):
     delete_file_if_exists(instance.file)
@@ -98,23 +153,71 @@ def auto_delete_profile_pic(sender, instance, **kwargs):
     delete_file_if_exists(instance.profile_pic)
 
 @receiver(pre_save, sender=Note)
-def auto_delete_old_note_file_on_change(sender, instance, **kwargs):
+def auto_delete_old_note_file_on_change(sender, instance, update_fields=None, **kwargs):
     if not instance.pk: 
         return False 
-    try:
-        old_file = Note.objects.get(pk=instance.pk).file
-        if old_file and old_file != instance.file:
-            delete_file_if_exists(old_file)
-    except Note.DoesNotExist: 
-        pass
+    if update_fields is not None and 'file' not in update_fields:
+        return False
+    old_file = Note.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+    if old_file != instance.file.name:
+        instance.ai_status_checked_at = None
+    if old_file and old_file != instance.file.name:
+        delete_file_if_exists_by_path(old_file)
 
 @receiver(pre_save, sender=Profile)
-def auto_delete_old_profile_pic_on_change(sender, instance, **kwargs):
+def auto_delete_old_profile_pic_on_change(sender, instance, update_fields=None, **kwargs):
     if not instance.pk: 
+        instance._pic_changed = bool(instance.profile_pic)
         return False
-    try:
-        old_pic = Profile.objects.get(pk=instance.pk).profile_pic
-        if old_pic and old_pic != instance.profile_pic:
-            delete_file_if_exists(old_pic)
-    except Profile.DoesNotExist: 
-        pass
+    if update_fields is not None and 'profile_pic' not in update_fields:
+        instance._pic_changed = False
+        return False
+    old_pic = Profile.objects.filter(pk=instance.pk).values_list('profile_pic', flat=True).first()
+    instance._pic_changed = (old_pic or '') != (instance.profile_pic.name or '')
+    if old_pic and old_pic != instance.profile_pic.name:
+        delete_file_if_exists_by_path(old_pic)
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_home_cache_on_change(sender, **kwargs):
+    invalidate_home_cache()
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def invalidate_note_cache_on_change(sender, instance, **kwargs):
+    invalidate_note_cache(instance.pk)
+
+@receiver(post_save, sender=Note)
+def update_note_search_vector(sender, instance, using, update_fields=None, **kwargs):
+    if update_fields is not None and not NOTE_SEARCH_FIELDS.intersection(update_fields):
+        return
+    refresh_note_search_vectors(using, pk=instance.pk)
+
+@receiver(post_save, sender=User)
+def update_author_search_vectors(sender, instance, created, using, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    refresh_note_search_vectors(using, user_id=instance.pk)
+
+@receiver(post_save, sender=Comment)
+def increment_note_comment_count(sender, instance, created, **kwargs):
+    if created:
+        Note.objects.filter(pk=instance.post_id).update(comment_count=F('comment_count') + 1)
+
+@receiver(post_delete, sender=Comment)
+def decrement_note_comment_count(sender, instance, **kwargs):
+    Note.objects.filter(pk=instance.post_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def refresh_note_avg_rating(sender, instance, **kwargs):
+    Note.objects.filter(pk=instance.note_id).update(avg_rating=note_avg_rating_subquery())
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_rating_cache_on_change(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_rating_cache, instance.note_id, instance.user_id))
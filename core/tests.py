@@ -1,3 +1,412 @@
-from django.test import TestCase
+import importlib
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .forms import NoteForm
+from .gemini import _safe_delete
+from .models import Comment, Note, Rating
+from .utils import OTP_TTL, _send_brevo_task, detect_mime, otp_check, otp_set
+from .views import _parse_range
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_closed_range(self):
+        self.assertEqual(_parse_range('bytes=0-9', 100), (0, 9))
+
+    def test_end_clamped_to_size(self):
+        self.assertEqual(_parse_range('bytes=90-500', 100), (90, 99))
+
+    def test_open_ended(self):
+        self.assertEqual(_parse_range('bytes=40-', 100), (40, 99))
+
+    def test_suffix(self):
+        self.assertEqual(_parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(_parse_range('bytes=-500', 100), (0, 99))
+
+    def test_unsatisfiable(self):
+        self.assertIs(_parse_range('bytes=100-', 100), False)
+        self.assertIs(_parse_range('bytes=50-10', 100), False)
+
+    def test_ignored(self):
+        self.assertIsNone(_parse_range('bytes=0-1,5-9', 100))
+        self.assertIsNone(_parse_range('bytes=-', 100))
+        self.assertIsNone(_parse_range('items=0-9', 100))
+
+
+class ServeMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root)
+        patcher = mock.patch('core.views.MEDIA_ROOT_REAL', self.media_root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with open(os.path.join(self.media_root, 'clip.txt'), 'wb') as f:
+            f.write(b'0123456789')
+
+    def get(self, path='/media/clip.txt', **headers):
+        with override_settings(MEDIA_ROOT=self.media_root, USE_XSENDFILE=False):
+            return self.client.get(path, **headers)
+
+    def test_partial_content(self):
+        response = self.get(HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+
+    def test_suffix_range(self):
+        response = self.get(HTTP_RANGE='bytes=-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+    def test_out_of_bounds_range(self):
+        response = self.get(HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_multi_range_serves_whole_file(self):
+        response = self.get(HTTP_RANGE='bytes=0-1,4-5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_if_range_mismatch_serves_whole_file(self):
+        response = self.get(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_if_range_match(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+    def test_rejected_paths(self):
+        self.assertEqual(self.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.get('/media/%00').status_code, 404)
+        self.assertEqual(self.get('/media/missing.txt').status_code, 404)
+
+
+class DetectMimeTests(SimpleTestCase):
+    def sniff(self, data):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(data)
+        self.addCleanup(os.remove, f.name)
+        return detect_mime(f.name)
+
+    def test_magic_numbers(self):
+        self.assertEqual(self.sniff(b'%PDF-1.7\n'), 'application/pdf')
+        self.assertEqual(self.sniff(b'\x89PNG\r\n\x1a\n\x00\x00'), 'image/png')
+        self.assertEqual(self.sniff(b'RIFF\x00\x00\x00\x00WEBPVP8 '), 'image/webp')
+
+    def test_ftyp_brands(self):
+        self.assertEqual(self.sniff(b'\x00\x00\x00\x18ftypisom\x00\x00\x02\x00'), 'video/mp4')
+        self.assertEqual(self.sniff(b'\x00\x00\x00\x18ftypheic\x00\x00\x00\x00'), 'image/heic')
+        self.assertIsNone(self.sniff(b'\x00\x00\x00\x18ftypzzzz\x00\x00\x00\x00'))
+
+    def test_utf8_text(self):
+        self.assertEqual(self.sniff('naïve café notes'.encode()), 'text/plain')
+
+    def test_utf8_cut_mid_character(self):
+        data = b'a' * 511 + 'é'.encode()
+        self.assertEqual(self.sniff(data), 'text/plain')
+
+    def test_binary(self):
+        self.assertIsNone(self.sniff(b'\x00\x01\x02\x03binary'))
+        self.assertIsNone(self.sniff(b'\xc3\x28 invalid utf-8'))
+
+
+class OtpTests(TestCase):
+    def setUp(self):
+        caches['otp'].clear()
+
+    def test_code_is_consumed(self):
+        otp_set('verify:1', '123456')
+        self.assertFalse(otp_check('verify:1', '654321'))
+        self.assertTrue(otp_check('verify:1', '123456'))
+        self.assertFalse(otp_check('verify:1', '123456'))
+
+    def test_missing_code(self):
+        self.assertFalse(otp_check('verify:2', '123456'))
+
+
+class UploadCsrfTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('core.views.send_email')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(User.objects.create_user('uploader', 'u@example.com', 'pw'))
+
+    def test_post_without_token_is_rejected(self):
+        response = self.client.post('/upload/', {'title': 'x'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_post_with_token_reaches_view(self):
+        token = 'a' * 32
+        self.client.cookies['csrftoken'] = token
+        response = self.client.post(
+            '/upload/', {'title': ''}, HTTP_X_CSRFTOKEN=token, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'error')
+
+
+class AiFileStatusTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('core.views.send_email')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('reader', 'r@example.com', 'pw')
+        self.client.force_login(self.user)
+
+    def status(self, name, content):
+        note = Note.objects.create(user=self.user, title='n', file=SimpleUploadedFile(name, content))
+        return self.client.get(f'/note/{note.pk}/ai-status/').json()
+
+    def test_small_supported_file_can_be_attached(self):
+        data = self.status('notes.txt', b'plain notes')
+        self.assertEqual(data['ai_status'], 'ready')
+        self.assertTrue(data['can_attach'])
+
+    def test_small_unsupported_file_cannot_be_attached(self):
+        data = self.status('notes.docx', b'PK\x03\x04' + b'\x00' * 100)
+        self.assertEqual(data['ai_status'], 'unsupported')
+        self.assertFalse(data['can_attach'])
+
+
+class EditNoteTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('core.views.send_email')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.owner = User.objects.create_user('owner', 'o@example.com', 'pw')
+        self.note = Note.objects.create(user=self.owner, title='Old', file=SimpleUploadedFile('a.txt', b'a'))
+        self.client.force_login(self.owner)
+
+    def test_counters_written_during_upload_survive(self):
+        reader = User.objects.create_user('reader', 'r@example.com', 'pw')
+        is_valid = NoteForm.is_valid
+
+        def activity_during_upload(form):
+            Comment.objects.create(post=self.note, user=reader, text='nice')
+            Rating.objects.create(note=self.note, user=reader, score=4)
+            return is_valid(form)
+
+        with mock.patch.object(NoteForm, 'is_valid', autospec=True, side_effect=activity_during_upload):
+            response = self.client.post(
+                f'/note/{self.note.pk}/edit/', {'title': 'New', 'file': SimpleUploadedFile('b.txt', b'b')},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+        self.assertEqual(response.json()['status'], 'success')
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.title, 'New')
+        self.assertEqual(self.note.comment_count, 1)
+        self.assertEqual(self.note.avg_rating, 4)
+
+
+class NoteCounterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', 'a@example.com', 'pw')
+        self.reader = User.objects.create_user('reader', 'r@example.com', 'pw')
+        self.note = Note.objects.create(user=self.author, title='n', file='notes/n.txt')
+
+    def test_comment_count_follows_comments(self):
+        first = Comment.objects.create(post=self.note, user=self.reader, text='a')
+        Comment.objects.create(post=self.note, user=self.author, text='b')
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.comment_count, 2)
+        first.delete()
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.comment_count, 1)
+
+    def test_avg_rating_follows_ratings(self):
+        rating = Rating.objects.create(note=self.note, user=self.reader, score=5)
+        Rating.objects.create(note=self.note, user=self.author, score=2)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.avg_rating, 3.5)
+        rating.score = 1
+        rating.save()
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.avg_rating, 1.5)
+        Rating.objects.filter(note=self.note).delete()
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.avg_rating, 0)
+
+    def test_migration_backfills_counters(self):
+        Comment.objects.create(post=self.note, user=self.reader, text='a')
+        Rating.objects.create(note=self.note, user=self.reader, score=4)
+        Note.objects.update(comment_count=0, avg_rating=0)
+        migration = importlib.import_module('core.migrations.0010_note_rating_and_comment_counters')
+        migration.backfill_note_counters(apps, None)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.comment_count, 1)
+        self.assertEqual(self.note.avg_rating, 4)
+
+
+class HomeCacheTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('core.views.send_email')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('browser', 'b@example.com', 'pw')
+        self.client.force_login(self.user)
+
+    def listed(self, path='/'):
+        return [note.title for note in self.client.get(path).context['notes']]
+
+    def test_changes_invalidate_cached_listing(self):
+        first = Note.objects.create(user=self.user, title='First', file='notes/1.txt')
+        self.assertEqual(self.listed(), ['First'])
+        Note.objects.create(user=self.user, title='Second', file='notes/2.txt')
+        self.assertEqual(self.listed(), ['Second', 'First'])
+        first.delete()
+        self.assertEqual(self.listed(), ['Second'])
+
+    def test_rating_reorders_cached_top_rated(self):
+        low = Note.objects.create(user=self.user, title='Low', file='notes/1.txt')
+        high = Note.objects.create(user=self.user, title='High', file='notes/2.txt')
+        Rating.objects.create(note=high, user=self.user, score=3)
+        self.assertEqual(self.listed('/?sort=top_rated'), ['High', 'Low'])
+        Rating.objects.create(note=low, user=self.user, score=5)
+        self.assertEqual(self.listed('/?sort=top_rated'), ['Low', 'High'])
+
+    def test_unknown_sort_falls_back_to_recent(self):
+        response = self.client.get('/?sort=bogus')
+        self.assertEqual(response.context['sort_by'], 'recent')
+
+
+@skipUnless(connection.vendor == 'postgresql', "search_vector is only maintained on PostgreSQL")
+class SearchVectorTests(TestCase):
+    def vector(self, note):
+        return Note.objects.values_list('search_vector', flat=True).get(pk=note.pk)
+
+    def test_vector_follows_note_and_author(self):
+        author = User.objects.create_user('calcfan', 'c@example.com', 'pw')
+        note = Note.objects.create(user=author, title='Algebra', file='notes/a.txt')
+        self.assertIn("'algebra':1A", self.vector(note))
+        self.assertIn("'calcfan'", self.vector(note))
+
+        note.title = 'Geometry'
+        note.save()
+        self.assertIn("'geometri':1A", self.vector(note))
+        self.assertNotIn('algebra', self.vector(note))
+
+        author.username = 'shapefan'
+        author.save()
+        self.assertIn("'shapefan'", self.vector(note))
+
+    def test_search_ranks_title_matches_first(self):
+        author = User.objects.create_user('writer', 'w@example.com', 'pw')
+        Note.objects.create(user=author, title='Physics', description='a little calculus', file='notes/p.txt')
+        Note.objects.create(user=author, title='Calculus', file='notes/c.txt')
+        with mock.patch('core.views.send_email'):
+            self.client.force_login(author)
+            notes = self.client.get('/?q=calculus').context['notes']
+        self.assertEqual([note.title for note in notes], ['Calculus', 'Physics'])
+
+
+class UnverifiedSignupTests(TestCase):
+    def signup(self, username, joined_ago, is_active=False, last_login=None):
+        user = User.objects.create_user(username, f'{username}@example.com', 'pw', is_active=is_active)
+        User.objects.filter(pk=user.pk).update(date_joined=timezone.now() - joined_ago, last_login=last_login)
+        return user
+
+    def test_sweep_removes_only_abandoned_signups(self):
+        self.signup('abandoned', timedelta(days=2))
+        self.signup('pending', timedelta(hours=1))
+        self.signup('deactivated', timedelta(days=2), last_login=timezone.now())
+        self.signup('member', timedelta(days=2), is_active=True)
+        call_command('sweep_unverified', stdout=io.StringIO())
+        self.assertEqual(
+            set(User.objects.values_list('username', flat=True)), {'pending', 'deactivated', 'member'}
+        )
+
+    def register(self, username):
+        with mock.patch('core.views.send_email'):
+            return self.client.post('/register/', {
+                'username': username, 'email': f'new-{username}@example.com',
+                'password1': 'Pw12345!x', 'password2': 'Pw12345!x',
+            }, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+    def test_register_reclaims_username_after_code_expires(self):
+        stale = self.signup('alice', timedelta(seconds=OTP_TTL + 60))
+        self.assertEqual(self.register('alice')['status'], 'success')
+        self.assertFalse(User.objects.filter(pk=stale.pk).exists())
+
+    def test_register_keeps_username_while_code_is_valid(self):
+        pending = self.signup('bob', timedelta(seconds=60))
+        self.assertEqual(self.register('bob')['status'], 'error')
+        self.assertTrue(User.objects.filter(pk=pending.pk).exists())
+
+
+class AiStatusResetTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.owner = User.objects.create_user('owner', 'o@example.com', 'pw')
+        self.note = Note.objects.create(user=self.owner, title='n', file=SimpleUploadedFile('a.txt', b'a'))
+        Note.objects.filter(pk=self.note.pk).update(ai_status='ready', ai_status_checked_at=timezone.now())
+        self.note.refresh_from_db()
+
+    def checked_at(self):
+        return Note.objects.values_list('ai_status_checked_at', flat=True).get(pk=self.note.pk)
+
+    def test_other_edits_keep_the_cached_diagnosis(self):
+        self.note.title = 'renamed'
+        self.note.save()
+        self.assertIsNotNone(self.checked_at())
+
+    def test_new_file_clears_the_cached_diagnosis(self):
+        self.note.file = SimpleUploadedFile('b.pdf', b'%PDF-1.7')
+        self.note.save()
+        self.assertIsNone(self.checked_at())
+
+    def test_edit_view_file_replacement_clears_the_cached_diagnosis(self):
+        with mock.patch('core.views.send_email'):
+            self.client.force_login(self.owner)
+        self.client.post(
+            f'/note/{self.note.pk}/edit/', {'title': 'n', 'file': SimpleUploadedFile('c.txt', b'c')},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertIsNone(self.checked_at())
+
+
+class EmailTaskTests(SimpleTestCase):
+    def test_transport_errors_are_logged(self):
+        api = mock.Mock(**{'send_transac_email.side_effect': ConnectionError('unreachable')})
+        with mock.patch('core.utils._get_brevo_api', return_value=api), \
+                self.assertLogs('core.utils', level='ERROR') as logs:
+            _send_brevo_task('a@example.com', 'Subject', '<p>hi</p>', 'A')
+        self.assertIn('a@example.com', logs.output[0])
+
+
+class GeminiCleanupTests(SimpleTestCase):
+    def test_transport_errors_are_logged(self):
+        with mock.patch('core.gemini.genai.delete_file', side_effect=TimeoutError('slow')), \
+                self.assertLogs('core.gemini', level='ERROR') as logs:
+            _safe_delete('files/abc123')
+        self.assertIn('files/abc123', logs.output[0])
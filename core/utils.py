@@ -1,85 +1,206 @@
+import codecs
+import hmac
+import logging
 import os
-import threading
+import string
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.http import HttpResponse
+import orjson
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
-import random
+import secrets
+
+logger = logging.getLogger(__name__)
 
 def delete_file_if_exists(file_field):
     if file_field and file_field.name:
         if os.path.isfile(file_field.path):
             try:
                 os.remove(file_field.path)
-                print(f"✅ File Deleted: {file_field.path}")
+                logger.info(f"File deleted: {file_field.path}")
             except Exception as e:
-                print(f"❌ Error deleting file: {e}")
+                logger.warning(f"Error deleting file {file_field.path}: {e}")
 
-def get_email_html(title, body_content, code=None, footer_text="Happy Learning!"):
-    header_color = "#667eea"
-    if "Alert" in title or "Delete" in title:
-        header_color = "#d93025"
-    elif "Welcome" in title:
-        header_color = "#0f9d58"
+def delete_file_if_exists_by_path(name):
+    if name:
+        try:
+            default_storage.delete(name)
+            logger.info(f"File deleted: {name}")
+        except Exception as e:
+            logger.warning(f"Error deleting file {name}: {e}")
 
-    code_block = ""
-    if code:
-        code_block = f"""
-        <div style="background-color: #f8f9fa; border: 2px dashed {header_color}; color: #333; 
+_MIME_MAGICS = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'\x1a\x45\xdf\xa3', 'video/webm'),
+    (b'OggS', 'audio/ogg'),
+    (b'fLaC', 'audio/flac'),
+    (b'ID3', 'audio/mpeg'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'PK\x03\x04', 'application/zip'),
+)
+_RIFF_MIMES = {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}
+_FTYP_MIMES = {
+    b'isom': 'video/mp4', b'iso2': 'video/mp4', b'mp41': 'video/mp4', b'mp42': 'video/mp4',
+    b'avc1': 'video/mp4', b'dash': 'video/mp4', b'M4V ': 'video/mp4',
+    b'M4A ': 'audio/mp4', b'qt  ': 'video/quicktime',
+    b'3gp4': 'video/3gpp', b'3gp5': 'video/3gpp',
+    b'heic': 'image/heic', b'heix': 'image/heic',
+    b'mif1': 'image/heif', b'msf1': 'image/heif',
+    b'avif': 'image/avif',
+}
+_MP3_FRAME_SYNCS = frozenset({b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'})
+MIME_SNIFF_BYTES = 512
+
+def detect_mime(path):
+    with open(path, 'rb') as f:
+        head = f.read(MIME_SNIFF_BYTES)
+
+    for magic, mime in _MIME_MAGICS:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b'RIFF':
+        return _RIFF_MIMES.get(head[8:12])
+    if head[4:8] == b'ftyp':
+        # Unknown brands are left to the extension rather than guessed.
+        return _FTYP_MIMES.get(head[8:12])
+    if head[:2] in _MP3_FRAME_SYNCS:
+        return 'audio/mpeg'
+
+    # The sniff window may end mid-character, so only a decode error before the last few bytes counts.
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return None
+    return None if b'\x00' in head else 'text/plain'
+
+_CODE_BLOCK_TEMPLATE = string.Template("""
+        <div style="background-color: #f8f9fa; border: 2px dashed $header_color; color: #333; 
                     font-size: 24px; font-weight: bold; padding: 15px; display: inline-block; 
                     margin: 20px 0; letter-spacing: 5px; border-radius: 8px;">
-            {code}
+            $code
         </div>
-        """
+        """)
 
-    html = f"""
+_EMAIL_TEMPLATE = string.Template("""
     <!DOCTYPE html>
     <html>
     <body style="font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f4f4; margin: 0; padding: 20px;">
         <div style="max-width: 600px; margin: 0 auto; background-color: #ffffff; border-radius: 10px; overflow: hidden; box-shadow: 0 4px 10px rgba(0,0,0,0.05);">
-            <div style="background: {header_color}; padding: 30px; text-align: center; color: white;">
+            <div style="background: $header_color; padding: 30px; text-align: center; color: white;">
                 <h1 style="margin: 0; font-size: 24px;">NoteShare</h1>
-                <p style="margin: 5px 0 0; opacity: 0.9;">{title}</p>
+                <p style="margin: 5px 0 0; opacity: 0.9;">$title</p>
             </div>
             <div style="padding: 40px; text-align: center; color: #333;">
-                <p style="font-size: 16px; line-height: 1.5;">{body_content}</p>
-                {code_block}
+                <p style="font-size: 16px; line-height: 1.5;">$body_content</p>
+                $code_block
                 <div style="margin-top: 20px; font-size: 12px; color: #999;">
-                    Time: {settings.TIME_ZONE} | System Generated
+                    Time: $time_zone | System Generated
                 </div>
             </div>
             <div style="background-color: #f8f9fa; padding: 15px; text-align: center; font-size: 12px; color: #888;">
-                &copy; 2025 NoteShare. {footer_text}
+                &copy; 2025 NoteShare. $footer_text
             </div>
         </div>
     </body>
     </html>
-    """
-    return html
+    """)
 
-def _send_brevo_task(to_email, subject, html_content, name):
+def get_email_html(title, body_content, code=None, footer_text="Happy Learning!"):
+    header_color = "#667eea"
+    if "Alert" in title or "Delete" in title:
+        header_color = "#d93025"
+    elif "Welcome" in title:
+        header_color = "#0f9d58"
+
+    code_block = ""
+    if code:
+        code_block = _CODE_BLOCK_TEMPLATE.substitute(header_color=header_color, code=code)
+
+    return _EMAIL_TEMPLATE.substitute(
+        header_color=header_color,
+        title=title,
+        body_content=body_content,
+        code_block=code_block,
+        time_zone=settings.TIME_ZONE,
+        footer_text=footer_text,
+    )
+
+OTP_TTL = 10 * 60
+HOME_CACHE_GENERATION_KEY = 'home:generation'
+RATING_CACHE_TIMEOUT = 60 * 60
+NOTE_CACHE_TIMEOUT = 10
+
+_EMAIL_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='email')
+
+@functools.lru_cache(maxsize=None)
+def _get_brevo_api():
     configuration = sib_api_v3_sdk.Configuration()
     configuration.api_key['api-key'] = settings.BREVO_API_KEY
-    api_instance = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
-    
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=[{"email": to_email, "name": name}],
-        sender={"email": settings.DEFAULT_FROM_EMAIL, "name": "NoteShare Security"},
-        subject=subject,
-        html_content=html_content
-    )
+    return sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
+
+def _send_brevo_task(to_email, subject, html_content, name):
+    # Runs on the email pool, whose futures nobody reads: anything not logged here is lost.
     try:
-        api_instance.send_transac_email(send_smtp_email)
+        send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
+            to=[{"email": to_email, "name": name}],
+            sender={"email": settings.DEFAULT_FROM_EMAIL, "name": "NoteShare Security"},
+            subject=subject,
+            html_content=html_content
+        )
+        _get_brevo_api().send_transac_email(send_smtp_email)
     except ApiException as e:
-        print(f"❌ Email Failed: {e}")
+        logger.warning(f"Email to {to_email} failed: {e}")
+    except Exception:
+        logger.exception(f"Email to {to_email} failed")
 
 def send_email(to_email, subject, title, body, user_name="User", code=None):
     html_content = get_email_html(title, body, code)
-    
-    email_thread = threading.Thread(
-        target=_send_brevo_task, 
-        args=(to_email, subject, html_content, user_name)
-    )
-    email_thread.start()
+    _EMAIL_POOL.submit(_send_brevo_task, to_email, subject, html_content, user_name)
 
 def generate_otp():
-    return str(random.randint(100000, 999999))
+    return ''.join(secrets.choice(string.digits) for _ in range(6))
+
+def otp_set(key, code, ttl=OTP_TTL):
+    caches['otp'].set(f"otp:{key}", code, timeout=ttl)
+
+def otp_get(key):
+    return caches['otp'].get(f"otp:{key}")
+
+def otp_check(key, code):
+    stored = otp_get(key)
+    if stored is None or not code:
+        return False
+    if not hmac.compare_digest(str(stored).encode(), str(code).encode()):
+        return False
+    caches['otp'].delete(f"otp:{key}")
+    return True
+
+# Home page list caches embed this value in their keys; replacing it orphans them all at once.
+def home_cache_generation():
+    return cache.get_or_set(HOME_CACHE_GENERATION_KEY, time.time_ns, timeout=None)
+
+def invalidate_home_cache():
+    cache.set(HOME_CACHE_GENERATION_KEY, time.time_ns(), timeout=None)
+
+def invalidate_rating_cache(note_id, user_id):
+    cache.delete(f"note:{note_id}:user:{user_id}:score")
+
+def invalidate_note_cache(note_id):
+    cache.delete(f"note:{note_id}:obj")
+
+
+def json_response(data, status=200):
+    return HttpResponse(orjson.dumps(data), content_type='application/json', status=status)
+
+def form_errors(*forms):
+    # ErrorList keeps its items outside the list storage orjson reads, so flatten to plain lists.
+    return {field: list(errors) for form in forms for field, errors in form.errors.items()}
@@ -1,7 +1,14 @@
 import os
-import json
-import threading
+import re
+import stat
+import hashlib
+import logging
 import mimetypes
+from functools import partial, wraps
+from datetime import timedelta
+from urllib.parse import quote
+import orjson
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout
@@ -9,77 +16,129 @@ from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_in
 from django.dispatch import receiver
 from django.contrib import messages
-from django.db.models import Avg, Count, Case, When, Value, IntegerField
-from django.http import JsonResponse, FileResponse, Http404
+from django.db import connection, connections, transaction
+from django.db.models import Avg, Count, Case, When, Value, IntegerField, F, Q
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.conf import settings
+from django.core.cache import cache
 from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import http_date
 
-from .forms import UserRegisterForm, ProfileForm, NoteForm, CommentForm
+from .forms import UserRegisterForm, ProfileForm, NoteForm, CommentForm, MAX_NOTE_FILE_SIZE
 from .models import Note, Profile, Comment, Rating
-from .utils import send_email, generate_otp, delete_file_if_exists
+from .utils import (
+    send_email, generate_otp, otp_set, otp_check, delete_file_if_exists, home_cache_generation,
+    json_response, form_errors, detect_mime, invalidate_note_cache, RATING_CACHE_TIMEOUT, NOTE_CACHE_TIMEOUT,
+    OTP_TTL,
+)
 from .gemini import generate_study_help
 
+logger = logging.getLogger(__name__)
+
+LOGIN_EMAIL_COOLDOWN = 5 * 60
+HOME_CACHE_TIMEOUT = 60
+HOME_SORTS = frozenset({'recent', 'oldest', 'most_viewed', 'top_rated'})
+
+# Slack for the multipart boundaries and the other form fields.
+MAX_NOTE_REQUEST_SIZE = MAX_NOTE_FILE_SIZE + 1024 * 1024
+
+MEDIA_ROOT_REAL = os.path.realpath(settings.MEDIA_ROOT)
+MEDIA_BLOCK_SIZE = 64 * 1024
+
+
+# Upload handlers can only be swapped before request.POST is read, so the CSRF
+# check moves from the middleware into the wrapper.
+def stream_uploads_to_disk(view_func):
+    protected_view = csrf_protect(view_func)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method == 'POST':
+            try:
+                content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                content_length = 0
+            if content_length > MAX_NOTE_REQUEST_SIZE:
+                if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                    return json_response({'status': 'error', 'errors': {'file': ["File too large. Max size is 35MB."]}})
+                messages.error(request, "File too large. Max size is 35MB.")
+                return redirect(request.path)
+            request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return protected_view(request, *args, **kwargs)
+
+    return csrf_exempt(wrapper)
+
 
 @receiver(user_logged_in)
 def on_user_logged_in(sender, request, user, **kwargs):
+    remote_addr = request.META.get('REMOTE_ADDR', '') if request else ''
+    if not cache.add(f"login_email:{user.pk}:{remote_addr}", 1, timeout=LOGIN_EMAIL_COOLDOWN):
+        return
     try:
-        threading.Thread(target=send_email, args=(
+        send_email(
             user.email,
             "Security Alert: New Login",
             "New Sign-In Detected",
             f"We detected a new login to your account <b>{user.username}</b>.",
             user.username
-        )).start()
-    except Exception as e:
-        print(f"Email Error: {e}")
+        )
+    except Exception:
+        logger.exception("Login alert email failed")
 
 
 def register(request):
     if request.method == 'POST':
         username = request.POST.get('username')
-        email = request.POST.get('email')
-        User.objects.filter(username=username, is_active=False).delete()
+        if username:
+            # Free a username held by a sign-up whose code has already expired without being used.
+            User.objects.filter(
+                username=username, is_active=False, last_login__isnull=True,
+                date_joined__lt=timezone.now() - timedelta(seconds=OTP_TTL),
+            ).delete()
 
         u_form = UserRegisterForm(request.POST)
         p_form = ProfileForm(request.POST, request.FILES)
         
         if u_form.is_valid() and p_form.is_valid():
             try:
-                user = u_form.save(commit=False)
-                user.is_active = False 
-                user.save()
-                
-                profile, created = Profile.objects.get_or_create(user=user)
-                profile.bio = p_form.cleaned_data.get('bio')
-                profile.profile_pic = p_form.cleaned_data.get('profile_pic')
-                profile.verification_code = generate_otp()
-                profile.save()
-                
-                send_email(
-                    user.email, "Verify Your Account", "Welcome to NoteShare!", 
-                    "Please verify your email address to activate your account.", 
-                    user.username, profile.verification_code
-                )
+                with transaction.atomic():
+                    user = u_form.save(commit=False)
+                    user.is_active = False 
+                    user.save()
+                    
+                    profile, created = Profile.objects.get_or_create(user=user)
+                    profile.bio = p_form.cleaned_data.get('bio')
+                    profile.profile_pic = p_form.cleaned_data.get('profile_pic')
+                    profile.save(update_fields=['bio', 'profile_pic'])
+
+                    otp = generate_otp()
+                    otp_set(f"verify:{user.id}", otp)
+                    transaction.on_commit(partial(
+                        send_email,
+                        user.email, "Verify Your Account", "Welcome to NoteShare!", 
+                        "Please verify your email address to activate your account.", 
+                        user.username, otp
+                    ))
                 
                 request.session['verification_id'] = user.id
                 
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'success', 'redirect_url': '/verify/'})
+                    return json_response({'status': 'success', 'redirect_url': '/verify/'})
                 
                 return redirect('verify_email')
             except Exception as e:
-                if user.id: user.delete()
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'error', 'errors': {'non_field_errors': ["Registration Error. Please try again."]}})
+                    return json_response({'status': 'error', 'errors': {'non_field_errors': ["Registration Error. Please try again."]}})
                 messages.error(request, "Registration Error. Please try again.")
         else:
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                errors = {}
-                for field, error_list in u_form.errors.items():
-                    errors[field] = error_list
-                for field, error_list in p_form.errors.items():
-                    errors[field] = error_list
-                return JsonResponse({'status': 'error', 'errors': errors})
+                return json_response({'status': 'error', 'errors': form_errors(u_form, p_form)})
 
     else:
         u_form = UserRegisterForm()
@@ -93,31 +152,33 @@ def verify_email(request):
         user_id = request.session.get('verification_id')
         if not user_id: 
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'message': 'Session expired. Login again.'})
+                return json_response({'status': 'error', 'message': 'Session expired. Login again.'})
             return redirect('login')
         
         try:
             user = User.objects.get(id=user_id)
-            if user.profile.verification_code == code:
-                user.is_active = True
-                user.profile.verification_code = None
-                user.save()
-                user.profile.save()
-                user.backend = 'django.contrib.auth.backends.ModelBackend'
-                login(request, user)
-                
-                send_email(user.email, "Welcome!", "Verification Successful", 
-                           "Your account is now active.", user.username)
+            if otp_check(f"verify:{user.id}", code):
+                with transaction.atomic():
+                    user.is_active = True
+                    user.save(update_fields=['is_active'])
+                    user.backend = 'django.contrib.auth.backends.ModelBackend'
+                    login(request, user)
+                    
+                    transaction.on_commit(partial(
+                        send_email,
+                        user.email, "Welcome!", "Verification Successful", 
+                        "Your account is now active.", user.username
+                    ))
                 
                 del request.session['verification_id']
                 
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'success', 'redirect_url': '/'})
+                    return json_response({'status': 'success', 'redirect_url': '/'})
 
                 return redirect('home')
             else:
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'error', 'message': 'Invalid Verification Code.'})
+                    return json_response({'status': 'error', 'message': 'Invalid Verification Code.'})
                 messages.error(request, "Invalid Code.")
         except User.DoesNotExist:
             return redirect('register')
@@ -134,56 +195,63 @@ def verify_email(request):
 
 @login_required
 def edit_profile(request):
-    Profile.objects.get_or_create(user=request.user)
-    request.user.refresh_from_db()
+    profile, created = Profile.objects.get_or_create(user=request.user)
+    request.user.profile = profile
 
     if request.method == 'POST':
         password = request.POST.get('password')
         if not password or not request.user.check_password(password):
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'message': "Incorrect Password. Changes not saved."})
+                return json_response({'status': 'error', 'message': "Incorrect Password. Changes not saved."})
             messages.error(request, "Incorrect Password. Changes not saved.")
             return redirect('edit_profile')
 
         try:
             request.user.first_name = request.POST.get('first_name')
             request.user.last_name = request.POST.get('last_name')
-            request.user.profile.bio = request.POST.get('bio')
-            request.user.profile.ai_instructions = request.POST.get('ai_instructions')
+            profile.bio = request.POST.get('bio')
+            profile.ai_instructions = request.POST.get('ai_instructions')
 
+            profile_fields = ['bio', 'ai_instructions']
             if request.POST.get('remove_picture') == 'on':
-                request.user.profile.profile_pic = None
+                profile.profile_pic = None
+                profile_fields.append('profile_pic')
             elif 'profile_pic' in request.FILES:
-                request.user.profile.profile_pic = request.FILES['profile_pic']
-
-            request.user.save()
-            request.user.profile.save()
+                profile.profile_pic = request.FILES['profile_pic']
+                profile_fields.append('profile_pic')
 
             new_email = request.POST.get('email')
-            if new_email and new_email != request.user.email:
+            email_changed = bool(new_email) and new_email != request.user.email
+
+            with transaction.atomic():
+                request.user.save(update_fields=['first_name', 'last_name'])
+                profile.save(update_fields=profile_fields)
+
+                if email_changed:
+                    otp = generate_otp()
+                    otp_set(f"email_change_old:{request.user.id}", otp)
+                    transaction.on_commit(partial(
+                        send_email,
+                        request.user.email, "Verify Email Change", "Email Change Request", 
+                        f"You requested to change email to <b>{new_email}</b>. Verify ownership of CURRENT email.", 
+                        request.user.username, otp
+                    ))
+
+            if email_changed:
                 request.session['pending_email'] = new_email
-                otp = generate_otp()
-                request.user.profile.verification_code = otp
-                request.user.profile.save()
-                
-                send_email(
-                    request.user.email, "Verify Email Change", "Email Change Request", 
-                    f"You requested to change email to <b>{new_email}</b>. Verify ownership of CURRENT email.", 
-                    request.user.username, otp
-                )
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'success', 'redirect_url': '/verify-change/step-1/'})
+                    return json_response({'status': 'success', 'redirect_url': '/verify-change/step-1/'})
                 return redirect('verify_email_change_old')
             
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'success', 'message': 'Profile updated successfully!', 'redirect_url': '/profile/'})
+                return json_response({'status': 'success', 'message': 'Profile updated successfully!', 'redirect_url': '/profile/'})
 
             messages.success(request, "Profile updated successfully.")
             return redirect('profile')
             
         except Exception as e:
              if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'message': "Error updating profile."})
+                return json_response({'status': 'error', 'message': "Error updating profile."})
              messages.error(request, "Error updating profile.")
 
     return render(request, 'edit_profile.html')
@@ -196,10 +264,9 @@ def verify_email_change_old(request):
 
     if request.method == 'POST':
         code = request.POST.get('code')
-        if request.user.profile.verification_code == code:
+        if otp_check(f"email_change_old:{request.user.id}", code):
             new_otp = generate_otp()
-            request.user.profile.verification_code = new_otp
-            request.user.profile.save()
+            otp_set(f"email_change_new:{request.user.id}", new_otp)
             request.session['step1_verified'] = True
             
             send_email(pending_email, "Email Change Step 2", "Verify New Email", 
@@ -207,11 +274,11 @@ def verify_email_change_old(request):
                        request.user.username, new_otp)
             
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'success', 'redirect_url': '/verify-change/step-2/'})
+                return json_response({'status': 'success', 'redirect_url': '/verify-change/step-2/'})
             return redirect('verify_email_change_new')
         else:
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'message': "Invalid Code."})
+                return json_response({'status': 'error', 'message': "Invalid Code."})
             messages.error(request, "Invalid Code.")
 
     context = {
@@ -232,28 +299,27 @@ def verify_email_change_new(request):
 
     if request.method == 'POST':
         code = request.POST.get('code')
-        if request.user.profile.verification_code == code:
+        if otp_check(f"email_change_new:{request.user.id}", code):
             old_email = request.user.email
             
-            request.user.email = pending_email
-            request.user.profile.verification_code = None
-            request.user.save()
-            request.user.profile.save()
+            with transaction.atomic():
+                User.objects.filter(pk=request.user.pk).update(email=pending_email)
+                request.user.email = pending_email
+                
+                transaction.on_commit(partial(send_email, old_email, "Email Changed", "Security Alert", f"Email changed to {pending_email}.", request.user.username))
+                transaction.on_commit(partial(send_email, pending_email, "Verified", "Success!", "Email updated successfully.", request.user.username))
             
             del request.session['pending_email']
             del request.session['step1_verified']
             
-            send_email(old_email, "Email Changed", "Security Alert", f"Email changed to {pending_email}.", request.user.username)
-            send_email(pending_email, "Verified", "Success!", "Email updated successfully.", request.user.username)
-            
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                 return JsonResponse({'status': 'success', 'redirect_url': '/profile/'})
+                 return json_response({'status': 'success', 'redirect_url': '/profile/'})
             
             messages.success(request, "Email changed successfully.")
             return redirect('profile')
         else:
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'message': "Invalid Code."})
+                return json_response({'status': 'error', 'message': "Invalid Code."})
             messages.error(request, "Invalid Code.")
 
     context = {
@@ -270,13 +336,12 @@ def verify_email_change_new(request):
 def init_delete_account(request):
     if request.method == 'POST':
         otp = generate_otp()
-        request.user.profile.verification_code = otp
-        request.user.profile.save()
+        otp_set(f"delete:{request.user.id}", otp)
         send_email(request.user.email, "Confirm Deletion", "Account Deletion", 
                    "Enter code to permanently delete your account.", request.user.username, otp)
         
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-            return JsonResponse({'status': 'success', 'redirect_url': '/profile/delete/verify/'})
+            return json_response({'status': 'success', 'redirect_url': '/profile/delete/verify/'})
 
         return redirect('verify_delete_account')
     return redirect('edit_profile')
@@ -285,19 +350,19 @@ def init_delete_account(request):
 @login_required
 def verify_delete_account(request):
     if request.method == 'POST':
-        if request.user.profile.verification_code == request.POST.get('code'):
+        if otp_check(f"delete:{request.user.id}", request.POST.get('code')):
             user = request.user
             logout(request)
             user.delete() 
             
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'success', 'redirect_url': '/login/'})
+                return json_response({'status': 'success', 'redirect_url': '/login/'})
 
             messages.success(request, "Your account has been deleted.")
             return redirect('login')
         
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-            return JsonResponse({'status': 'error', 'message': "Invalid Code."})
+            return json_response({'status': 'error', 'message': "Invalid Code."})
         messages.error(request, "Invalid Code.")
 
     context = {
@@ -317,23 +382,22 @@ def forgot_password(request):
             user = User.objects.get(username=username)
             if not user.email:
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'error', 'message': "No email linked."})
+                    return json_response({'status': 'error', 'message': "No email linked."})
                 messages.error(request, "No email linked.")
             else:
                 otp = generate_otp()
-                user.profile.verification_code = otp
-                user.profile.save()
+                otp_set(f"reset:{user.id}", otp)
                 send_email(user.email, "Reset Password", "Password Reset", "Use this code to reset password.", user.username, otp)
                 request.session['reset_user_id'] = user.id
                 
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'success', 'redirect_url': '/forgot-password/verify/'})
+                    return json_response({'status': 'success', 'redirect_url': '/forgot-password/verify/'})
                 
                 messages.success(request, f"Code sent to email.")
                 return redirect('verify_forgot_code')
         except User.DoesNotExist:
              if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'message': "Username not found."})
+                return json_response({'status': 'error', 'message': "Username not found."})
              messages.error(request, "Username not found.")
     return render(request, 'forgot_password.html')
 
@@ -344,22 +408,16 @@ def verify_forgot_code(request):
     
     if request.method == 'POST':
         code = request.POST.get('code')
-        try:
-            user = User.objects.get(id=user_id)
-            if user.profile.verification_code == code:
-                request.session['code_verified'] = True
-                user.profile.verification_code = None
-                user.profile.save()
-                
-                if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'success', 'redirect_url': '/forgot-password/reset/'})
-
-                return redirect('reset_new_password')
+        if otp_check(f"reset:{user_id}", code):
+            request.session['code_verified'] = True
+            
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'message': "Invalid Code."})
-            messages.error(request, "Invalid Code.")
-        except User.DoesNotExist:
-            return redirect('forgot_password')
+                return json_response({'status': 'success', 'redirect_url': '/forgot-password/reset/'})
+
+            return redirect('reset_new_password')
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return json_response({'status': 'error', 'message': "Invalid Code."})
+        messages.error(request, "Invalid Code.")
 
     context = {
         'title': 'Reset Password',
@@ -380,7 +438,7 @@ def reset_new_password(request):
         if p1 == p2:
             user = User.objects.get(id=request.session['reset_user_id'])
             user.set_password(p1)
-            user.save()
+            user.save(update_fields=['password'])
             
             request.session.pop('reset_user_id', None)
             request.session.pop('code_verified', None)
@@ -388,13 +446,13 @@ def reset_new_password(request):
             send_email(user.email, "Security Alert", "Password Changed", "Password reset successful.", user.username)
             
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'success', 'redirect_url': '/login/'})
+                return json_response({'status': 'success', 'redirect_url': '/login/'})
 
             messages.success(request, "Password reset successfully. Please login.")
             return redirect('login')
         else:
              if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'message': "Passwords do not match."})
+                return json_response({'status': 'error', 'message': "Passwords do not match."})
              messages.error(request, "Passwords do not match.")
     return render(request, 'reset_new_password.html')
 
@@ -402,82 +460,114 @@ def reset_new_password(request):
 def forgot_username(request):
     if request.method == 'POST':
         email = request.POST.get('email')
-        users = User.objects.filter(email__iexact=email)
-        if users.exists():
-            names = ", ".join([u.username for u in users])
+        names = ", ".join(User.objects.filter(email__iexact=email).values_list('username', flat=True))
+        if names:
             send_email(email, "Your Usernames", "Forgot Username", f"Usernames found: <b>{names}</b>")
         
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-             return JsonResponse({'status': 'success', 'redirect_url': '/login/'})
+             return json_response({'status': 'success', 'redirect_url': '/login/'})
 
         messages.success(request, "If registered, usernames sent to email.")
         return redirect('login')
     return render(request, 'forgot_username.html')
 
 
+# The icontains filter in _home_note_ids decides what matches; this only ranks.
+def _search_relevance(query):
+    if connection.vendor == 'postgresql':
+        terms = re.findall(r'\w+', query)
+        if terms:
+            search_query = SearchQuery(' | '.join(f"{t}:*" for t in terms), search_type='raw', config='english')
+            return Coalesce(SearchRank(F('search_vector'), search_query), Value(0.0))
+    return (
+        Case(When(title__icontains=query, then=Value(10)), default=Value(0), output_field=IntegerField()) +
+        Case(When(tags__icontains=query, then=Value(8)), default=Value(0), output_field=IntegerField()) +
+        Case(When(course__icontains=query, then=Value(6)), default=Value(0), output_field=IntegerField()) +
+        Case(When(user__username__icontains=query, then=Value(4)), default=Value(0), output_field=IntegerField()) +
+        Case(When(description__icontains=query, then=Value(2)), default=Value(0), output_field=IntegerField())
+    )
+
+
 @login_required
 def home(request):
     query = request.GET.get('q')
     sort_by = request.GET.get('sort', 'recent')
-    
-    notes = Note.objects.select_related('user', 'user__profile').annotate(
-        avg_rating=Avg('ratings__score'), 
-        comment_count=Count('comments')
-    )
+    if sort_by not in HOME_SORTS:
+        sort_by = 'recent'
+
+    query_hash = hashlib.md5((query or '').encode()).hexdigest()
+    cache_key = f"home_ids:{home_cache_generation()}:{sort_by}:{query_hash}"
+    note_ids = cache.get(cache_key)
+    if note_ids is None:
+        note_ids = _home_note_ids(query, sort_by)
+        cache.set(cache_key, note_ids, HOME_CACHE_TIMEOUT)
+
+    notes_by_pk = Note.objects.select_related('user', 'user__profile').only(
+        'title', 'course', 'description', 'view_count', 'avg_rating', 'comment_count',
+        'user__username', 'user__profile__profile_pic'
+    ).in_bulk(note_ids)
+    notes = [notes_by_pk[pk] for pk in note_ids if pk in notes_by_pk]
+
+    return render(request, 'home.html', {'notes': notes, 'query': query, 'sort_by': sort_by})
+
+
+def _home_note_ids(query, sort_by):
+    notes = Note.objects.all()
 
     if query:
-        notes = notes.annotate(
-            relevance=(
-                Case(When(title__icontains=query, then=Value(10)), default=Value(0), output_field=IntegerField()) +
-                Case(When(tags__icontains=query, then=Value(8)), default=Value(0), output_field=IntegerField()) +
-                Case(When(course__icontains=query, then=Value(6)), default=Value(0), output_field=IntegerField()) +
-                Case(When(user__username__icontains=query, then=Value(4)), default=Value(0), output_field=IntegerField()) +
-                Case(When(description__icontains=query, then=Value(2)), default=Value(0), output_field=IntegerField())
-            )
-        ).filter(relevance__gt=0).order_by('-relevance', '-avg_rating', '-created_at')
+        # Matching the joined username in the same OR would stop PostgreSQL from combining the
+        # trigram indexes on the note columns, so author matches are looked up separately.
+        column_matches = Note.objects.filter(
+            Q(title__icontains=query) | Q(tags__icontains=query) | Q(course__icontains=query) |
+            Q(description__icontains=query)
+        ).values('pk')
+        author_matches = Note.objects.filter(
+            user_id__in=User.objects.filter(username__icontains=query).values('pk')
+        ).values('pk')
+        notes = notes.filter(pk__in=column_matches.union(author_matches)).annotate(relevance=_search_relevance(query)).order_by('-relevance', '-avg_rating', '-created_at')
 
     if sort_by == 'oldest': notes = notes.order_by('created_at')
     elif sort_by == 'most_viewed': notes = notes.order_by('-view_count')
     elif sort_by == 'top_rated': notes = notes.order_by('-avg_rating')
     elif not query: notes = notes.order_by('-created_at')
 
-    return render(request, 'home.html', {'notes': notes, 'query': query, 'sort_by': sort_by})
+    return list(notes.values_list('pk', flat=True))
 
 
 @login_required
 def profile(request):
-    notes = Note.objects.filter(user=request.user).select_related('user', 'user__profile').annotate(
-        avg_rating=Avg('ratings__score'),
-        comment_count=Count('comments')
+    notes = Note.objects.filter(user=request.user).only(
+        'title', 'course', 'tags', 'description', 'file', 'view_count', 'avg_rating', 'comment_count', 'created_at'
     ).order_by('-created_at')
     return render(request, 'profile.html', {'notes': notes})
 
 
 def public_profile(request, username):
-    profile_user = get_object_or_404(User, username=username)
-    user_notes = Note.objects.filter(user=profile_user).select_related('user', 'user__profile').annotate(
-        avg_rating=Avg('ratings__score'),
-        comment_count=Count('comments')
+    profile_user = get_object_or_404(User.objects.select_related('profile'), username=username)
+    user_notes = Note.objects.filter(user=profile_user).only(
+        'title', 'course', 'description', 'view_count', 'avg_rating', 'comment_count', 'created_at'
     ).order_by('-created_at')
     return render(request, 'public_profile.html', {'profile_user': profile_user, 'user_notes': user_notes})
 
 
 @login_required
 def note_detail(request, pk):
-    note = get_object_or_404(Note, pk=pk)
+    note = get_object_or_404(Note.objects.select_related('user', 'user__profile'), pk=pk)
     
-    session_key = f'viewed_note_{pk}'
-    if not request.session.get(session_key, False):
+    if cache.add(f"viewed:{request.user.id}:{pk}", 1, timeout=settings.SESSION_COOKIE_AGE):
+        Note.objects.filter(pk=pk).update(view_count=F('view_count') + 1)
         note.view_count += 1
-        note.save()
-        request.session[session_key] = True
 
-    avg_rating = round(note.ratings.aggregate(Avg('score'))['score__avg'] or 0, 1)
+    avg_rating = round(note.avg_rating, 1)
     
     user_rating = None
     if request.user.is_authenticated:
-        rating_obj = note.ratings.filter(user=request.user).first()
-        if rating_obj: user_rating = rating_obj.score
+        # 0 marks "not rated" so a miss can be told apart from a cached no-rating.
+        user_rating = cache.get_or_set(
+            f"note:{pk}:user:{request.user.id}:score",
+            lambda: note.ratings.filter(user=request.user).values_list('score', flat=True).first() or 0,
+            RATING_CACHE_TIMEOUT,
+        ) or None
 
     if request.method == 'POST' and 'comment_submit' in request.POST:
         c_form = CommentForm(request.POST)
@@ -485,15 +575,16 @@ def note_detail(request, pk):
             new_comment = Comment.objects.create(post=note, user=request.user, text=c_form.cleaned_data['text'])
             
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({
+                profile_pic = request.user.profile.profile_pic
+                return json_response({
                     'status': 'success',
-                    'username': new_comment.user.username,
+                    'username': request.user.username,
                     'text': new_comment.text,
                     'time': 'Just now',
-                    'profile_url': f"/user/{new_comment.user.username}/",
-                    'avatar_url': new_comment.user.profile.profile_pic.url if new_comment.user.profile.profile_pic else None,
-                    'user_initial': new_comment.user.username[0].upper(),
-                    'is_author': new_comment.user == note.user,
+                    'profile_url': f"/user/{request.user.username}/",
+                    'avatar_url': profile_pic.url if profile_pic else None,
+                    'user_initial': request.user.username[0].upper(),
+                    'is_author': request.user.pk == note.user_id,
                     'comment_id': new_comment.pk
                 })
 
@@ -501,11 +592,12 @@ def note_detail(request, pk):
     else:
         c_form = CommentForm()
 
-    comments = note.comments.all().order_by('-created_at')
+    comments = note.comments.select_related('user', 'user__profile').order_by('-created_at')
     return render(request, 'note_detail.html', {'note': note, 'comments': comments, 'c_form': c_form, 'avg_rating': avg_rating, 'user_rating': user_rating})
 
 
 @login_required
+@stream_uploads_to_disk
 def upload_note(request):
     if request.method == 'POST':
         form = NoteForm(request.POST, request.FILES)
@@ -515,7 +607,7 @@ def upload_note(request):
             note.save()
             
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({
+                return json_response({
                     'status': 'success', 
                     'message': 'Note uploaded successfully!', 
                     'redirect_url': '/' 
@@ -524,7 +616,7 @@ def upload_note(request):
             return redirect('home')
         else:
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'errors': form.errors})
+                return json_response({'status': 'error', 'errors': form_errors(form)})
 
     else:
         form = NoteForm()
@@ -532,6 +624,7 @@ def upload_note(request):
 
 
 @login_required
+@stream_uploads_to_disk
 def edit_note(request, pk):
     note = get_object_or_404(Note, pk=pk)
     if request.user != note.user: 
@@ -540,10 +633,13 @@ def edit_note(request, pk):
     if request.method == 'POST':
         form = NoteForm(request.POST, request.FILES, instance=note)
         if form.is_valid():
-            form.save()
+            note = form.save(commit=False)
+            # Comments and ratings may have moved the counters while the upload streamed in, so
+            # only the edited columns are written back (plus the file-check reset from pre_save).
+            note.save(update_fields=[*NoteForm._meta.fields, 'ai_status_checked_at'])
             
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({
+                return json_response({
                     'status': 'success', 
                     'message': 'Changes saved! Redirecting...',
                     'next_url': f"/note/{pk}/"
@@ -553,7 +649,7 @@ def edit_note(request, pk):
             return redirect('note_detail', pk=pk)
         else:
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'error', 'errors': form.errors})
+                return json_response({'status': 'error', 'errors': form_errors(form)})
     else:
         form = NoteForm(instance=note)
     
@@ -567,12 +663,12 @@ def delete_note(request, pk):
         note.delete() 
         
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-            return JsonResponse({'status': 'success', 'redirect_url': '/profile/'})
+            return json_response({'status': 'success', 'redirect_url': '/profile/'})
             
         messages.success(request, "Note deleted successfully.")
     else:
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-             return JsonResponse({'status': 'error', 'message': "Unauthorized"})
+             return json_response({'status': 'error', 'message': "Unauthorized"})
         messages.error(request, "Unauthorized")
     return redirect('profile')
 
@@ -583,23 +679,23 @@ def rate_note(request, pk):
         note = get_object_or_404(Note, pk=pk)
         score = request.POST.get('score')
         
-        if score == '0':
-            Rating.objects.filter(user=request.user, note=note).delete()
-            user_score = 0
-        elif score: 
-            Rating.objects.update_or_create(user=request.user, note=note, defaults={'score': int(score)})
-            user_score = int(score)
-            
-        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-            new_avg = note.ratings.aggregate(Avg('score'))['score__avg'] or 0
-            new_avg = round(new_avg, 1)
-            
-            return JsonResponse({
-                'status': 'success',
-                'avg_rating': new_avg,
-                'user_score': user_score,
-                'count': note.ratings.count()
-            })
+        with transaction.atomic():
+            if score == '0':
+                Rating.objects.filter(user=request.user, note=note).delete()
+                user_score = 0
+            elif score: 
+                Rating.objects.update_or_create(user=request.user, note=note, defaults={'score': int(score)})
+                user_score = int(score)
+                
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                agg = note.ratings.aggregate(avg=Avg('score'), cnt=Count('id'))
+                
+                return json_response({
+                    'status': 'success',
+                    'avg_rating': round(agg['avg'] or 0, 1),
+                    'user_score': user_score,
+                    'count': agg['cnt']
+                })
 
     return redirect('note_detail', pk=pk)
 
@@ -613,140 +709,190 @@ def delete_comment(request, pk):
             comment.delete()
             
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'success', 'pk': pk})
+                return json_response({'status': 'success', 'pk': pk})
             
             return redirect('note_detail', pk=comment.post.pk)
             
     return redirect('home')
 
 
-@login_required
-def ai_chat_page(request, pk):
-    note = get_object_or_404(Note, pk=pk)
-    
-    ai_status = 'ready'
-    status_msg = "Full File Context Active"
-    
-    MAX_SIZE_BYTES = 200 * 1024 * 1024 
-
+MAX_AI_FILE_SIZE = 200 * 1024 * 1024
+AI_STATUS_TTL = timedelta(hours=1)
+AI_INLINE_FILE_LIMIT = 1024 * 1024
+
+# Prompt budget per field; Gemini latency and billing grow with input tokens.
+AI_DESCRIPTION_LIMIT = 500
+AI_COURSE_LIMIT = 100
+AI_TAGS_LIMIT = 200
+AI_COMMENT_LIMIT = 200
+AI_TEXT_EXTS = frozenset({
+    'txt', 'md', 'csv', 'html', 'htm', 'xml', 'json', 'yaml', 'yml', 'env',
+    'py', 'js', 'ts', 'java', 'c', 'cpp', 'h', 'css', 'sql', 'sh', 'bat', 'php', 'rb', 'go'
+})
+AI_DOCUMENT_MIMES = frozenset({'application/pdf', 'text/plain'})
+AI_MEDIA_PREFIXES = ('image/', 'video/', 'audio/')
+AI_MEDIA_MIME = {
+    'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif',
+    'webp': 'image/webp', 'bmp': 'image/bmp', 'svg': 'image/svg+xml',
+    'mp4': 'video/mp4', 'webm': 'video/webm', 'mov': 'video/quicktime',
+    'mp3': 'audio/mpeg', 'wav': 'audio/wav', 'ogg': 'audio/ogg', 'm4a': 'audio/mp4', 'flac': 'audio/flac',
+}
+
+
+def _trim(text, limit):
+    text = (text or '').strip()
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+# One stat per call: the status check and the API both need existence, size and type of the note's file.
+def _classify_note_file(note):
     if not note.file:
-        ai_status = 'no_file'
-        status_msg = "Metadata Only (No File)"
-    else:
-        try:
-            if not os.path.exists(note.file.path):
-                ai_status = 'error'
-                status_msg = "Server Error: File Missing"
-            
-            elif note.file.size > MAX_SIZE_BYTES:
-                ai_status = 'too_large'
-                mb_size = note.file.size / (1024*1024)
-                status_msg = f"File Too Large ({mb_size:.0f}MB) • Metadata Mode"
-            
-            else:
-                raw_path = note.file.path
-                ext = raw_path.split('.')[-1].lower()
-                
-                supported_exts = [
-                    'pdf', 'txt', 'md', 'csv', 'html', 'htm', 'xml', 'json', 'yaml', 'yml', 
-                    'py', 'js', 'java', 'c', 'cpp', 'h', 'css', 'sql', 'sh', 'bat', 'php'
-                ]
-                
-                guessed_type, _ = mimetypes.guess_type(raw_path)
-                is_media = guessed_type and guessed_type.startswith(('image/', 'video/', 'audio/'))
+        return 'no_file', "Metadata Only (No File)", None, None, None
 
-                if ext not in supported_exts and not is_media:
-                    ai_status = 'unsupported'
-                    status_msg = f"Unsupported Format ({ext.upper()}) • Metadata Mode"
-                    
-        except Exception as e:
-            ai_status = 'error'
-            status_msg = "File Access Error • Metadata Mode"
+    try:
+        file_path = note.file.path
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return 'error', "Server Error: File Missing", None, None, None
+    except (OSError, ValueError):
+        return 'error', "File Access Error • Metadata Mode", None, None, None
+
+    if st.st_size > MAX_AI_FILE_SIZE:
+        return 'too_large', f"File Too Large ({st.st_size / (1024*1024):.0f}MB) • Metadata Mode", None, None, st.st_size
 
+    try:
+        mime_type = detect_mime(file_path)
+    except OSError:
+        return 'error', "File Access Error • Metadata Mode", None, None, None
+
+    ext = os.path.splitext(file_path)[1][1:].lower()
+    if mime_type is None:
+        # Nothing recognisable in the header: non-UTF-8 text, or a container the sniffer doesn't know.
+        if ext in AI_TEXT_EXTS:
+            mime_type = 'text/plain'
+        else:
+            mime_type = AI_MEDIA_MIME.get(ext) or mimetypes.guess_type(file_path)[0]
+            if mime_type and not mime_type.startswith(AI_MEDIA_PREFIXES):
+                mime_type = None
+
+    if not mime_type or not (mime_type in AI_DOCUMENT_MIMES or mime_type.startswith(AI_MEDIA_PREFIXES)):
+        return 'unsupported', f"Unsupported Format ({ext.upper()}) • Metadata Mode", None, None, st.st_size
+
+    return 'ready', "Full File Context Active", mime_type, file_path, st.st_size
+
+
+# Replacing the file clears ai_status_checked_at (see the Note pre_save receiver); the TTL
+# catches files that change or disappear on disk behind Django's back.
+def _cached_note_ai_status(note):
+    if note.ai_status_checked_at and timezone.now() - note.ai_status_checked_at < AI_STATUS_TTL:
+        return note.ai_status, note.ai_status_msg, note.ai_file_size
+
+    ai_status, status_msg, _, _, file_size = _classify_note_file(note)
+    Note.objects.filter(pk=note.pk).update(
+        ai_status=ai_status, ai_status_msg=status_msg[:200],
+        ai_file_size=file_size, ai_status_checked_at=timezone.now()
+    )
+    invalidate_note_cache(note.pk)
+    return ai_status, status_msg, file_size
+
+
+# Everything ai_chat.html, the status check and the prompt read; counters and the author's
+# other columns (password hash included) stay out of the row and out of the cache.
+AI_NOTE_FIELDS = (
+    'title', 'description', 'course', 'tags', 'file', 'created_at', 'user__username',
+    'ai_status', 'ai_status_msg', 'ai_file_size', 'ai_status_checked_at',
+)
+
+
+# An active chat hits the page, the status check and the API for the same note within seconds.
+def _get_note_cached(pk):
+    key = f"note:{pk}:obj"
+    note = cache.get(key)
+    if note is None:
+        note = get_object_or_404(Note.objects.select_related('user').only(*AI_NOTE_FIELDS), pk=pk)
+        cache.set(key, note, NOTE_CACHE_TIMEOUT)
+    return note
+
+
+@login_required
+def ai_chat_page(request, pk):
+    note = _get_note_cached(pk)
+
+    # The file is only checked when the user reaches for the file toggle (see ai_file_status).
     context = {
         'note': note,
-        'ai_status': ai_status,  
-        'status_msg': status_msg  
+        'ai_status': 'deferred',
+        'status_msg': "Checking…",
     }
     return render(request, 'ai_chat.html', context)
 
 
 @login_required
-def ai_chat_api(request):
+def ai_file_status(request, pk):
+    note = _get_note_cached(pk)
+    ai_status, status_msg, file_size = _cached_note_ai_status(note)
+
+    can_attach = ai_status == 'ready' and file_size < AI_INLINE_FILE_LIMIT
+    if ai_status == 'ready' and not can_attach:
+        status_msg = f"File Over {AI_INLINE_FILE_LIMIT // (1024*1024)}MB • Metadata Mode"
+    return json_response({'ai_status': ai_status, 'status_msg': status_msg, 'can_attach': can_attach})
+
+
+def _generate_study_help_off_thread(**kwargs):
+    # The upload cache may be the DatabaseCache, which opens a connection on this executor
+    # thread; request_finished only cleans up the request thread's connections.
+    try:
+        return generate_study_help(**kwargs)
+    finally:
+        connections.close_all()
+
+
+@login_required
+async def ai_chat_api(request):
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
+            data = orjson.loads(request.body)
             user_message = data.get('message', '')
             note_id = data.get('note_id')
             use_file = data.get('use_file', False)  
 
             if not user_message:
-                return JsonResponse({'error': "Message empty."}, status=400)
+                return json_response({'error': "Message empty."}, status=400)
 
-            note = get_object_or_404(Note, pk=note_id)
+            note = await sync_to_async(_get_note_cached)(note_id)
             uploaded_dt = note.created_at.strftime("%B %d, %Y")
             
-            latest_comments = note.comments.select_related('user').order_by('-created_at')[:10]
-            comment_str = ""
-            if latest_comments:
-                for c in reversed(latest_comments):
-                    comment_str += f"- {c.user.username}: {c.text}\n"
-            else:
-                comment_str = "No comments yet."
-
-            context_text = (
-                f"=== NOTE METADATA ===\n"
-                f"Title: {note.title}\n"
-                f"Description: {note.description}\n"
-                f"Course: {note.course}\n"
-                f"Tags: {note.tags}\n"
-                f"Uploaded By: {note.user.username}\n"
-                f"Date: {uploaded_dt}\n\n"
-                f"=== COMMUNITY COMMENTS ===\n{comment_str}"
+            latest_comments = [c async for c in note.comments.select_related('user').order_by('-created_at')[:10]]
+            comment_str = "".join(
+                f"- {c.user.username}: {_trim(c.text, AI_COMMENT_LIMIT)}\n" for c in reversed(latest_comments)
             )
 
+            metadata = [f"Title: {note.title}"]
+            for label, value, limit in (
+                ("Description", note.description, AI_DESCRIPTION_LIMIT),
+                ("Course", note.course, AI_COURSE_LIMIT),
+                ("Tags", note.tags, AI_TAGS_LIMIT),
+            ):
+                value = _trim(value, limit)
+                if value:
+                    metadata.append(f"{label}: {value}")
+            metadata.append(f"Uploaded By: {note.user.username}")
+            metadata.append(f"Date: {uploaded_dt}")
+
+            context_text = "=== NOTE METADATA ===\n" + "\n".join(metadata) + "\n"
+            if comment_str:
+                context_text += f"\n=== COMMUNITY COMMENTS ===\n{comment_str}"
+
             file_path = None
             mime_type = None
-            MAX_SIZE_BYTES = 200 * 1024 * 1024 
 
             if use_file and note.file:
-                try:
-                    real_path = note.file.path
-                    
-                    if not os.path.exists(real_path):
-                        context_text += "\n\n[SYSTEM WARNING: File not found on server disk. Answer based on metadata.]"
-                    
-                    elif note.file.size > MAX_SIZE_BYTES:
-                        size_mb = note.file.size / (1024 * 1024)
-                        context_text += f"\n\n[SYSTEM NOTE: File skipped because it is too large ({size_mb:.1f} MB). Limit is 200 MB.]"
-                    
-                    else:
-                        mimetypes.init()
-                        ext = real_path.split('.')[-1].lower()
-                        
-                        if ext == 'pdf':
-                            mime_type = 'application/pdf'
-                            file_path = real_path
-
-                        elif ext in ['txt', 'md', 'csv', 'html', 'xml', 'json', 'yaml', 'env', 
-                                     'py', 'js', 'java', 'c', 'cpp', 'css', 'sql', 'php', 'rb', 'go', 'ts']:
-                            mime_type = 'text/plain'
-                            file_path = real_path
-
-                        else:
-                            guessed_type, _ = mimetypes.guess_type(real_path)
-                            if guessed_type and guessed_type.startswith(('image/', 'video/', 'audio/')):
-                                mime_type = guessed_type
-                                file_path = real_path
-                            else:
-                                context_text += f"\n\n[SYSTEM NOTE: The file type ({ext}) cannot be read directly by AI. Answer based on Metadata & Comments.]"
-
-                except Exception as e:
-                    print(f"File Check Error: {e}")
-                    context_text += f"\n[System Error reading file: {str(e)}]"
-                    file_path = None
-
-            ai_response = generate_study_help(
+                ai_status, status_msg, mime_type, file_path, _ = await sync_to_async(_classify_note_file)(note)
+                if ai_status != 'ready':
+                    context_text += f"\n\n[SYSTEM NOTE: File not sent to AI ({status_msg}). Answer based on Metadata & Comments.]"
+
+            # The Gemini round-trip can take tens of seconds; under ASGI this keeps the event loop free.
+            ai_response = await sync_to_async(_generate_study_help_off_thread, thread_sensitive=False)(
                 user_prompt=user_message,
                 context=context_text,
                 user_instructions="", 
@@ -754,28 +900,102 @@ def ai_chat_api(request):
                 mime_type=mime_type
             )
 
-            return JsonResponse({'response': ai_response})
+            return json_response({'response': ai_response})
 
         except Exception as e:
-            print(f"API Error: {e}")
-            return JsonResponse({'error': str(e)}, status=500)
+            logger.exception("AI chat request failed")
+            return json_response({'error': str(e)}, status=500)
+
+    return json_response({'error': 'POST only'}, status=405)
+
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _parse_range(header, size):
+    # Only single ranges are honoured; anything else falls back to a full 200 response.
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    else:
+        start = max(size - int(end), 0)
+        end = size - 1
+    if start > end:
+        return False
+    return start, end
 
-    return JsonResponse({'error': 'POST only'}, status=405)
+
+def _iter_file_range(file, start, length):
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(MEDIA_BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
 
 
 def serve_media_inline(request, path):
-    file_path = os.path.join(settings.MEDIA_ROOT, path)
+    try:
+        file_path = os.path.realpath(os.path.join(MEDIA_ROOT_REAL, path))
+    except ValueError:  # e.g. an embedded null byte
+        raise Http404("File not found")
 
-    if not os.path.normpath(file_path).startswith(os.path.normpath(settings.MEDIA_ROOT)):
+    if os.path.commonpath([file_path, MEDIA_ROOT_REAL]) != MEDIA_ROOT_REAL:
         raise Http404("Access Denied")
 
-    if not os.path.exists(file_path):
+    try:
+        st = os.stat(file_path)
+    except (OSError, ValueError):
         raise Http404("File not found")
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404("File not found")
+
+    etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+    last_modified = int(st.st_mtime)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        not_modified['Last-Modified'] = http_date(last_modified)
+        return not_modified
 
     content_type, encoding = mimetypes.guess_type(file_path)
     content_type = content_type or 'application/octet-stream'
 
-    response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and not settings.USE_XSENDFILE and (not if_range or if_range == etag):
+        byte_range = _parse_range(range_header, st.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{st.st_size}'
+        return response
+
+    if settings.USE_XSENDFILE:
+        rel_path = os.path.relpath(file_path, MEDIA_ROOT_REAL).replace(os.sep, '/')
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.XSENDFILE_PREFIX + quote(rel_path)
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _iter_file_range(open(file_path, 'rb'), start, end - start + 1),
+            status=206, content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+        response.block_size = MEDIA_BLOCK_SIZE
     response['Content-Disposition'] = f'inline; filename="{os.path.basename(file_path)}"'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
 
     return response
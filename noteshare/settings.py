@@ -60,6 +60,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'noteshare.wsgi.application'
+# Production runs the ASGI app (see Procfile) so the async AI chat view doesn't hold a worker.
+ASGI_APPLICATION = 'noteshare.asgi.application'
 
 # -------------------------
 # DATABASE (Postgres via Railway)
@@ -67,10 +69,63 @@ WSGI_APPLICATION = 'noteshare.wsgi.application'
 DATABASES = {
     'default': dj_database_url.config(
         default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
-        conn_max_age=600,
+        # Under ASGI each request's sync code runs on a fresh thread, so persistent
+        # connections would pile up one per request instead of being reused.
+        conn_max_age=0,
         ssl_require=False,   # Railway PG usually doesn't need SSL internally
     )
 }
+DATABASES['default']['ATOMIC_REQUESTS'] = False   # views open their own transaction.atomic() blocks
+
+# Local SQLite fallback: WAL lets note pages keep reading while a write is in flight.
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['OPTIONS'] = {
+        'init_command': (
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA cache_size=-65536;"
+            "PRAGMA mmap_size=268435456;"
+            "PRAGMA temp_store=MEMORY;"
+        ),
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,
+    }
+
+# -------------------------
+# CACHE & SESSIONS (Redis when REDIS_URL is set, e.g. redis://... or unix:///path/redis.sock)
+# -------------------------
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+else:
+    # Without Redis the cache still has to be shared by every gunicorn worker and survive
+    # restarts (view de-duplication, invalidation keys, rating caches), so it lives in the DB.
+    # The table is created by `manage.py createcachetable` in build.sh.
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+SESSION_CACHE_ALIAS = 'default'
+
+# One-time codes must survive restarts and be visible to every worker, and must not be culled
+# or evicted by ordinary cache churn, so they get their own DB-backed cache regardless of Redis.
+CACHES['otp'] = {
+    'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+    'LOCATION': 'otp_cache',
+    'OPTIONS': {'MAX_ENTRIES': 100000},
+}
 
 AUTH_PASSWORD_VALIDATORS = []
 
@@ -87,6 +142,11 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# With nginx in front, media can be handed off via X-Accel-Redirect to an `internal` location
+# aliased to MEDIA_ROOT, so Django only does the routing and the bytes go out through sendfile.
+USE_XSENDFILE = os.environ.get('USE_XSENDFILE') == 'True'
+XSENDFILE_PREFIX = os.environ.get('XSENDFILE_PREFIX', '/internal-media/')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = 'home'
@@ -99,7 +159,7 @@ DEFAULT_FROM_EMAIL = "rodeatharva05@gmail.com"
 GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY', None)
 if not GOOGLE_API_KEY:
     print("❌ WARNING: GOOGLE_API_KEY is None! AI will not work.")
-else:
+elif DEBUG:
     print(f"✅ Google API Key loaded (Length: {len(GOOGLE_API_KEY)})")
 
 if not DEBUG:
@@ -39,6 +39,7 @@ urlpatterns = [
     path('profile/delete/verify/', views.verify_delete_account, name='verify_delete_account'),
 
     path('note/<int:pk>/study/', views.ai_chat_page, name='ai_chat_page'),
+    path('note/<int:pk>/ai-status/', views.ai_file_status, name='ai_file_status'),
     path('api/ai-chat/', views.ai_chat_api, name='ai_chat_api'),
 
     re_path(r'^media/(?P<path>.*)$', views.serve_media_inline, name='serve_media'),